@@ -1,9 +1,14 @@
 import requests
+from requests.adapters import HTTPAdapter
 import time
 import os
 import uuid
 import json
+import hashlib
+import random
 import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 # ─────────────────────────────────────────────
 # CONFIGURATION
@@ -15,6 +20,18 @@ HF_SPACE_URL = "https://sanjjiiev-blockdrive.hf.space"
 NODE_ID_FILE = "node_id.txt"
 STORAGE_DIR = "node_storage"
 
+# Shared HTTP session so every poll reuses the same TCP+TLS connection
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=50, max_retries=3))
+
+# Worker threads for processing a batch of relay tasks concurrently
+TASK_WORKERS = 8
+TASK_POOL = ThreadPoolExecutor(max_workers=TASK_WORKERS)
+
+DOWNLOAD_BLOCK_SIZE = 64 * 1024  # Bytes written per step when storing a chunk
+HAS_FADVISE = hasattr(os, "posix_fadvise")  # Linux only
+DONTNEED_THRESHOLD = 32 * 1024 * 1024  # Served chunks above this are dropped from page cache
+
 # Load or generate persistent Node ID
 if os.path.exists(NODE_ID_FILE):
     with open(NODE_ID_FILE, "r") as f:
@@ -33,116 +50,211 @@ print(f"📂 Storage: {os.path.abspath(STORAGE_DIR)}")
 print(f"🔗 Connecting to: {HF_SPACE_URL}")
 
 def register():
+    """Send a heartbeat to the relay. Returns True if it was accepted."""
     try:
         # We register with port 0 to indicate "Relay Mode" (or just standard)
         payload = {"ip": NODE_ID, "port": 0}
-        resp = requests.post(f"{HF_SPACE_URL}/api/register", json=payload, timeout=10)
+        resp = SESSION.post(f"{HF_SPACE_URL}/api/register", json=payload, timeout=10)
         if resp.status_code == 200:
             print(f"[+] Heartbeat sent. Online.")
-        else:
-            print(f"[-] Register failed: {resp.text}")
+            return True
+        print(f"[-] Register failed: {resp.text}")
     except Exception as e:
         print(f"[-] Connection failed: {e}")
+    return False
+
+def fadvise(f, advice):
+    """Best-effort page cache hint (named os.POSIX_FADV_* constant) for an open file."""
+    if not HAS_FADVISE:
+        return
+    try:
+        os.posix_fadvise(f.fileno(), 0, 0, getattr(os, advice))
+    except OSError:
+        pass
+
+def handle_task(task):
+    """Execute a single store/retrieve task handed out by the relay."""
+    if task.get("type") == "store":
+        chunk_name = task.get("chunk_name")
+        print(f"📥 Downloading chunk: {chunk_name}...")
+        
+        part_path = None
+        try:
+            # Download from Relay, streaming to a temp file so a dropped
+            # connection never leaves a truncated chunk under its real name
+            with SESSION.get(f"{HF_SPACE_URL}/api/download_relay/{chunk_name}",
+                             stream=True, timeout=30) as r_file:
+                if r_file.status_code == 200:
+                    path = os.path.join(STORAGE_DIR, chunk_name)
+                    # Unique per download, so concurrent stores never share a temp file
+                    fd, part_path = tempfile.mkstemp(dir=STORAGE_DIR, prefix=chunk_name + ".", suffix=".part")
+                    size = 0
+                    with os.fdopen(fd, "wb") as f:
+                        for block in r_file.iter_content(chunk_size=DOWNLOAD_BLOCK_SIZE):
+                            f.write(block)
+                            size += len(block)
+                    os.replace(part_path, path)
+                    
+                    print(f"✅ Stored {chunk_name} ({size} bytes)")
+                    
+                    # Confirm
+                    SESSION.post(f"{HF_SPACE_URL}/api/confirm_task", params={
+                        "node_id": NODE_ID,
+                        "chunk_name": chunk_name,
+                        "status": "success"
+                    }, timeout=10)
+                else:
+                    print(f"❌ Failed to download {chunk_name}: {r_file.status_code}")
+        except Exception as e:
+            print(f"❌ Error storing {chunk_name}: {e}")
+            if part_path and os.path.exists(part_path):
+                os.remove(part_path)
+    
+    elif task.get("type") == "retrieve":
+        chunk_name = task.get("chunk_name")
+        print(f"📤 Serving request for chunk: {chunk_name}...")
+        
+        try:
+            path = os.path.join(STORAGE_DIR, chunk_name)
+            if not os.path.exists(path):
+                print(f"❌ Requested chunk not found: {chunk_name}")
+                return
+            with open(path, "rb") as f:
+                # Chunks are read front to back; let the kernel prefetch it all
+                fadvise(f, "POSIX_FADV_SEQUENTIAL")
+                fadvise(f, "POSIX_FADV_WILLNEED")
+                try:
+                    files = {"file": (chunk_name, f)}
+                    data = {"chunk_name": chunk_name}
+                    # Push to Relay
+                    r = SESSION.post(f"{HF_SPACE_URL}/api/relay_push", 
+                                    files=files, data=data, timeout=60)
+                    if r.status_code == 200:
+                        print(f"✅ Pushed {chunk_name} to relay")
+                    else:
+                        print(f"❌ Failed to push {chunk_name}: {r.text}")
+                finally:
+                    # Drop only large chunks so one of them doesn't evict the
+                    # small hot ones; small chunks stay cached for the next read
+                    if os.fstat(f.fileno()).st_size > DONTNEED_THRESHOLD:
+                        fadvise(f, "POSIX_FADV_DONTNEED")
+        except Exception as e:
+            print(f"❌ Error pushing {chunk_name}: {e}")
+
+def run_task(task):
+    """Run one task, containing any failure so it can't fail the whole poll."""
+    try:
+        handle_task(task)
+    except Exception as e:
+        print(f"❌ Task {task!r} failed: {e}")
+
+def dedupe_store_tasks(tasks):
+    """Drop repeated store tasks for the same chunk so they don't race on one file."""
+    seen = set()
+    unique = []
+    for task in tasks:
+        if isinstance(task, dict) and task.get("type") == "store":
+            if task.get("chunk_name") in seen:
+                continue
+            seen.add(task.get("chunk_name"))
+        unique.append(task)
+    return unique
 
 def process_tasks():
+    """Handle all pending relay tasks.
+    Returns how many tasks were received, or None if polling failed."""
     try:
-        resp = requests.get(f"{HF_SPACE_URL}/api/poll_tasks", params={"node_id": NODE_ID}, timeout=10)
+        resp = SESSION.get(f"{HF_SPACE_URL}/api/poll_tasks", params={"node_id": NODE_ID}, timeout=10)
         if resp.status_code == 200:
             data = resp.json()
             tasks = data.get("tasks", [])
             
-            for task in tasks:
-                if task.get("type") == "store":
-                    chunk_name = task.get("chunk_name")
-                    print(f"📥 Downloading chunk: {chunk_name}...")
-                    
-                    # Download from Relay
-                    r_file = requests.get(f"{HF_SPACE_URL}/api/download_relay/{chunk_name}", timeout=30)
-                    if r_file.status_code == 200:
-                        path = os.path.join(STORAGE_DIR, chunk_name)
-                        with open(path, "wb") as f:
-                            f.write(r_file.content)
-                        
-                        print(f"✅ Stored {chunk_name} ({len(r_file.content)} bytes)")
-                        
-                        # Confirm
-                        requests.post(f"{HF_SPACE_URL}/api/confirm_task", params={
-                            "node_id": NODE_ID,
-                            "chunk_name": chunk_name,
-                            "status": "success"
-                        })
-                    else:
-                        print(f"❌ Failed to download {chunk_name}: {r_file.status_code}")
-                
-                elif task.get("type") == "retrieve":
-                    chunk_name = task.get("chunk_name")
-                    print(f"📤 Serving request for chunk: {chunk_name}...")
-                    
-                    path = os.path.join(STORAGE_DIR, chunk_name)
-                    if os.path.exists(path):
-                        try:
-                            with open(path, "rb") as f:
-                                files = {"file": (chunk_name, f)}
-                                data = {"chunk_name": chunk_name}
-                                # Push to Relay
-                                r = requests.post(f"{HF_SPACE_URL}/api/relay_push", 
-                                                files=files, data=data, timeout=60)
-                                if r.status_code == 200:
-                                    print(f"✅ Pushed {chunk_name} to relay")
-                                else:
-                                    print(f"❌ Failed to push {chunk_name}: {r.text}")
-                        except Exception as e:
-                            print(f"❌ Error pushing {chunk_name}: {e}")
-                    else:
-                        print(f"❌ Requested chunk not found: {chunk_name}")
+            # Tasks are independent, so a burst drains in parallel
+            list(TASK_POOL.map(run_task, dedupe_store_tasks(tasks)))
+            return len(tasks)
+        print(f"[-] Poll failed: {resp.status_code}")
     except Exception as e:
         print(f"[-] Error polling: {e}")
+    return None
 
 # ─────────────────────────────────────────────
 # BLOCKCHAIN SYNC (Decentralization)
 # ─────────────────────────────────────────────
 LOCAL_CHAIN_FILE = "local_chain.json"
 
+def hash_block(block):
+    """SHA-256 of a block, using the backend's sorted-key JSON encoding."""
+    return hashlib.sha256(json.dumps(block, sort_keys=True).encode()).hexdigest()
+
+def find_tampered_block(chain):
+    """Return the list position of the first block whose previous_hash
+    doesn't match the block before it, or None if the whole chain links up."""
+    for pos in range(1, len(chain)):
+        if chain[pos].get("previous_hash") != hash_block(chain[pos - 1]):
+            return pos
+    return None
+
 def sync_blockchain():
     """Fetch and validate the blockchain from the backend.
     Each node keeps a local verified copy for decentralization."""
     try:
-        r = requests.get(f"{HF_SPACE_URL}/api/chain", timeout=10)
+        r = SESSION.get(f"{HF_SPACE_URL}/api/chain", timeout=10)
         if r.status_code == 200:
             data = r.json()
             chain = data.get("chain", [])
+            if not chain:
+                return
             
             # Validate chain integrity locally
-            v = requests.get(f"{HF_SPACE_URL}/api/validate", timeout=10)
-            if v.status_code == 200:
-                result = v.json()
-                if result.get("valid"):
-                    # Save verified chain locally
-                    with open(LOCAL_CHAIN_FILE, "w") as f:
-                        json.dump({"chain": chain, "synced_at": time.time()}, f, indent=2)
-                    print(f"🔗 Chain synced & verified ({len(chain)} blocks)")
-                else:
-                    print(f"⚠️ WARNING: Backend chain TAMPERED at block {result.get('tampered_at')}!")
+            tampered_at = find_tampered_block(chain)
+            if tampered_at is None:
+                # Save verified chain locally
+                with open(LOCAL_CHAIN_FILE, "w") as f:
+                    json.dump({"chain": chain, "synced_at": time.time()}, f, indent=2)
+                print(f"🔗 Chain synced & verified ({len(chain)} blocks)")
+            else:
+                block_id = chain[tampered_at].get("index", f"#{tampered_at}")
+                print(f"⚠️ WARNING: Backend chain TAMPERED at block {block_id}!")
     except Exception as e:
         print(f"[-] Chain sync failed: {e}")
 
 # ─────────────────────────────────────────────
 # MAIN LOOP
 # ─────────────────────────────────────────────
-SYNC_INTERVAL = 12  # Sync chain every 12 polls (~60s)
+SYNC_INTERVAL = 60  # Seconds between chain syncs, however fast the loop is polling
+POLL_INTERVAL = 5   # Seconds between idle polls (and between heartbeats)
+BUSY_POLL_INTERVAL = 0.5  # Seconds between polls while the relay has tasks queued
+MAX_BACKOFF = 60    # Upper bound on the retry delay while the relay is unreachable
 
 def main():
-    poll_count = 0
+    fails = 0
+    task_count = 0
+    online = False
+    last_heartbeat = 0
+    last_sync = time.monotonic()
     while True:
-        register()
-        process_tasks()
+        tick_start = time.monotonic()
+        # Fast re-polls while draining a backlog only heartbeat once per POLL_INTERVAL
+        if fails or not task_count or tick_start - last_heartbeat >= POLL_INTERVAL:
+            online = register()
+            last_heartbeat = tick_start
+        task_count = process_tasks()
+        fails = 0 if online and task_count is not None else fails + 1
         
-        # Sync blockchain periodically
-        poll_count += 1
-        if poll_count % SYNC_INTERVAL == 0:
+        # Sync blockchain periodically (by wall time, since busy polls are short)
+        if tick_start - last_sync >= SYNC_INTERVAL:
             sync_blockchain()
+            last_sync = tick_start
         
-        time.sleep(5) # Poll every 5 seconds
+        if fails:
+            # Back off exponentially with jitter so nodes don't reconnect in lockstep
+            backoff = min(MAX_BACKOFF, POLL_INTERVAL * 2 ** fails)
+            time.sleep(random.uniform(backoff / 2, backoff))
+        elif task_count:
+            time.sleep(BUSY_POLL_INTERVAL) # Relay has work queued, poll again soon
+        else:
+            # Subtract time spent on this iteration so heartbeats don't drift later
+            time.sleep(max(0, POLL_INTERVAL - (time.monotonic() - tick_start)))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file